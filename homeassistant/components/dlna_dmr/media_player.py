@@ -2,14 +2,16 @@
 from __future__ import annotations
 
 import asyncio
+from dataclasses import dataclass, field
 from datetime import timedelta
 import functools
 import logging
 
 import aiohttp
-from async_upnp_client import UpnpFactory
+from async_upnp_client import UpnpDevice, UpnpEventHandler, UpnpFactory
 from async_upnp_client.aiohttp import AiohttpNotifyServer, AiohttpSessionRequester
 from async_upnp_client.profiles.dlna import DeviceState, DmrDevice
+from async_upnp_client.profiles.profile import SUBSCRIBE_TIMEOUT
 import voluptuous as vol
 
 from homeassistant.components.media_player import PLATFORM_SCHEMA, MediaPlayerEntity
@@ -42,12 +44,13 @@ from homeassistant.const import (
     STATE_PAUSED,
     STATE_PLAYING,
 )
+from homeassistant.core import callback
 from homeassistant.exceptions import PlatformNotReady
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.event import async_call_later
 from homeassistant.helpers.typing import HomeAssistantType
 from homeassistant.util import get_local_ip
-import homeassistant.util.dt as dt_util
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -56,6 +59,19 @@ DLNA_DMR_DATA = "dlna_dmr"
 DEFAULT_NAME = "DLNA Digital Media Renderer"
 DEFAULT_LISTEN_PORT = 8301
 
+# Events arriving within this many seconds result in a single state write
+EVENT_COALESCE_DELAY = 0.1
+
+# Without subscriptions to these services the device has to be polled
+EVENTED_SERVICE_TYPES = {
+    "urn:schemas-upnp-org:service:AVTransport:1",
+    "urn:schemas-upnp-org:service:AVTransport:2",
+    "urn:schemas-upnp-org:service:AVTransport:3",
+    "urn:schemas-upnp-org:service:RenderingControl:1",
+    "urn:schemas-upnp-org:service:RenderingControl:2",
+    "urn:schemas-upnp-org:service:RenderingControl:3",
+}
+
 CONF_LISTEN_IP = "listen_ip"
 CONF_LISTEN_PORT = "listen_port"
 CONF_CALLBACK_URL_OVERRIDE = "callback_url_override"
@@ -93,23 +109,30 @@ HOME_ASSISTANT_UPNP_MIME_TYPE_MAPPING = {
 }
 
 
-def catch_request_errors():
-    """Catch asyncio.TimeoutError, aiohttp.ClientError errors."""
+@dataclass
+class DlnaDmrData:
+    """Runtime data shared by all DLNA DMR entities."""
+
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending_devices: dict[str, asyncio.Task] = field(default_factory=dict)
+    requester: AiohttpSessionRequester | None = None
+    factory: UpnpFactory | None = None
+    notify_server: AiohttpNotifyServer | None = None
+    event_handler: UpnpEventHandler | None = None
 
-    def call_wrapper(func):
-        """Call wrapper for decorator."""
 
-        @functools.wraps(func)
-        async def wrapper(self, *args, **kwargs):
-            """Catch asyncio.TimeoutError, aiohttp.ClientError errors."""
-            try:
-                return await func(self, *args, **kwargs)
-            except (asyncio.TimeoutError, aiohttp.ClientError):
-                _LOGGER.error("Error during call %s", func.__name__)
+def catch_request_errors(func):
+    """Catch asyncio.TimeoutError, aiohttp.ClientError errors."""
 
-        return wrapper
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        """Catch asyncio.TimeoutError, aiohttp.ClientError errors."""
+        try:
+            return await func(self, *args, **kwargs)
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            _LOGGER.error("Error during call %s", func.__name__)
 
-    return call_wrapper
+    return wrapper
 
 
 async def async_start_event_handler(
@@ -120,9 +143,9 @@ async def async_start_event_handler(
     callback_url_override: str | None = None,
 ):
     """Register notify view."""
-    hass_data = hass.data[DLNA_DMR_DATA]
-    if "event_handler" in hass_data:
-        return hass_data["event_handler"]
+    hass_data: DlnaDmrData = hass.data[DLNA_DMR_DATA]
+    if hass_data.event_handler is not None:
+        return hass_data.event_handler
 
     # start event handler
     server = AiohttpNotifyServer(
@@ -133,8 +156,8 @@ async def async_start_event_handler(
     )
     await server.start_server()
     _LOGGER.info("UPNP/DLNA event handler listening, url: %s", server.callback_url)
-    hass_data["notify_server"] = server
-    hass_data["event_handler"] = server.event_handler
+    hass_data.notify_server = server
+    hass_data.event_handler = server.event_handler
 
     # register for graceful shutdown
     async def async_stop_server(event):
@@ -144,7 +167,22 @@ async def async_start_event_handler(
 
     hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop_server)
 
-    return hass_data["event_handler"]
+    return hass_data.event_handler
+
+
+async def async_create_upnp_device(
+    hass: HomeAssistantType, hass_data: DlnaDmrData, url: str
+) -> UpnpDevice:
+    """Create a UPnP device, sharing in-flight fetches of the same url."""
+    pending_devices = hass_data.pending_devices
+    task = pending_devices.get(url)
+    if task is None:
+        task = hass.async_create_task(hass_data.factory.async_create_device(url))
+        pending_devices[url] = task
+        task.add_done_callback(lambda _: pending_devices.pop(url, None))
+
+    # shield so a cancelled caller does not cancel the fetch for the others
+    return await asyncio.shield(task)
 
 
 async def async_setup_platform(
@@ -159,30 +197,33 @@ async def async_setup_platform(
         name = discovery_info.get("name")
 
     if DLNA_DMR_DATA not in hass.data:
-        hass.data[DLNA_DMR_DATA] = {}
-
-    if "lock" not in hass.data[DLNA_DMR_DATA]:
-        hass.data[DLNA_DMR_DATA]["lock"] = asyncio.Lock()
-
-    # build upnp/aiohttp requester
-    session = async_get_clientsession(hass)
-    requester = AiohttpSessionRequester(session, True)
-
-    # ensure event handler has been started
-    async with hass.data[DLNA_DMR_DATA]["lock"]:
-        server_host = config.get(CONF_LISTEN_IP)
-        if server_host is None:
-            server_host = get_local_ip()
-        server_port = config.get(CONF_LISTEN_PORT, DEFAULT_LISTEN_PORT)
-        callback_url_override = config.get(CONF_CALLBACK_URL_OVERRIDE)
+        hass.data[DLNA_DMR_DATA] = DlnaDmrData()
+    hass_data: DlnaDmrData = hass.data[DLNA_DMR_DATA]
+
+    # build upnp/aiohttp requester, on a session of our own so cookies set by
+    # renderers are not stored or sent to other integrations
+    if hass_data.requester is None:
+        session = async_create_clientsession(hass, cookie_jar=aiohttp.DummyCookieJar())
+        hass_data.requester = AiohttpSessionRequester(session, True)
+        hass_data.factory = UpnpFactory(
+            hass_data.requester, disable_state_variable_validation=True
+        )
+    requester = hass_data.requester
+
+    # ensure event handler has been started, only its creation needs the lock
+    server_host = config.get(CONF_LISTEN_IP)
+    if server_host is None:
+        server_host = get_local_ip()
+    server_port = config.get(CONF_LISTEN_PORT, DEFAULT_LISTEN_PORT)
+    callback_url_override = config.get(CONF_CALLBACK_URL_OVERRIDE)
+    async with hass_data.lock:
         event_handler = await async_start_event_handler(
             hass, server_host, server_port, requester, callback_url_override
         )
 
     # create upnp device
-    factory = UpnpFactory(requester, disable_state_variable_validation=True)
     try:
-        upnp_device = await factory.async_create_device(url)
+        upnp_device = await async_create_upnp_device(hass, hass_data, url)
     except (asyncio.TimeoutError, aiohttp.ClientError) as err:
         raise PlatformNotReady() from err
 
@@ -192,7 +233,7 @@ async def async_setup_platform(
     # create our own device
     device = DlnaDmrDevice(dlna_device, name)
     _LOGGER.debug("Adding device: %s", device)
-    async_add_entities([device], True)
+    async_add_entities([device])
 
 
 class DlnaDmrDevice(MediaPlayerEntity):
@@ -202,9 +243,13 @@ class DlnaDmrDevice(MediaPlayerEntity):
         """Initialize DLNA DMR device."""
         self._device = dmr_device
         self._name = name
+        self._unique_id = dmr_device.udn
 
         self._available = False
-        self._subscription_renew_time = None
+        self._event_subscribed = False
+        self._unsub_resubscribe = None
+        self._state_write_handle = None
+        self._supported_features = None
 
     async def async_added_to_hass(self):
         """Handle addition."""
@@ -214,6 +259,34 @@ class DlnaDmrDevice(MediaPlayerEntity):
         bus = self.hass.bus
         bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_on_hass_stop)
 
+        # Only subscribe once added, so an aborted add leaves no renewal behind.
+        # Independent round trips, so fetch the state while subscribing
+        await asyncio.gather(self._async_update_device(), self._async_subscribe())
+        if not self._available:
+            self._async_clear_subscription()
+
+    async def async_will_remove_from_hass(self):
+        """Handle removal."""
+        # Stop events from scheduling writes for the removed entity
+        self._device.on_event = None
+        self._async_cancel_resubscribe()
+        if self._state_write_handle is not None:
+            self._state_write_handle.cancel()
+            self._state_write_handle = None
+
+        # The event handler is shared by all renderers, so only unsubscribe
+        # the services of this one
+        event_handler = self.hass.data[DLNA_DMR_DATA].event_handler
+        async with self.hass.data[DLNA_DMR_DATA].lock:
+            for service in self._device.device.services.values():
+                if event_handler.sid_for_service(service) is None:
+                    continue
+                try:
+                    await event_handler.async_unsubscribe(service)
+                except (asyncio.TimeoutError, aiohttp.ClientError):
+                    _LOGGER.debug("Could not unsubscribe from %s", service)
+        self._event_subscribed = False
+
     @property
     def available(self):
         """Device is available."""
@@ -221,41 +294,122 @@ class DlnaDmrDevice(MediaPlayerEntity):
 
     async def _async_on_hass_stop(self, event):
         """Event handler on Home Assistant stop."""
-        async with self.hass.data[DLNA_DMR_DATA]["lock"]:
+        self._async_cancel_resubscribe()
+        async with self.hass.data[DLNA_DMR_DATA].lock:
             await self._device.async_unsubscribe_services()
 
     async def async_update(self):
         """Retrieve the latest data."""
+        if self._event_subscribed and self._device.state != DeviceState.PLAYING:
+            # Events keep the state current, AVTransport does not event the
+            # playback position so that still needs polling while playing.
+            # Events don't tell when the device goes away, so check it is there
+            await self._async_ping_device()
+            return
+
         was_available = self._available
+        await self._async_update_device()
+        # Only subscribe once the device answers again, not on every failed poll
+        if self._available and not was_available:
+            await self._async_subscribe()
 
+    async def _async_update_device(self):
+        """Poll the device for its current state."""
         try:
             await self._device.async_update()
             self._available = True
         except (asyncio.TimeoutError, aiohttp.ClientError):
             self._available = False
             _LOGGER.debug("Device unavailable")
-            return
+            self._async_clear_subscription()
+
+    async def _async_ping_device(self):
+        """Check the device is still reachable."""
+        try:
+            await self._device.device.async_ping()
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            self._available = False
+            _LOGGER.debug("Device unavailable")
+            self._async_clear_subscription()
+
+    async def _async_subscribe(self):
+        """(Re-)subscribe to events and schedule the renewal or a retry."""
+        self._async_cancel_resubscribe()
+        # Retry failed or refused subscriptions at the renewal interval too
+        timeout = SUBSCRIBE_TIMEOUT
+        try:
+            timeout = await self._device.async_subscribe_services()
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            self._event_subscribed = False
+            _LOGGER.debug("Could not (re)subscribe")
+        else:
+            # A refused SUBSCRIBE is only logged by DmrDevice, so check that
+            # the event handler holds a subscription for each service
+            self._event_subscribed = self._has_event_subscriptions()
+            if not self._event_subscribed:
+                _LOGGER.debug("Event subscription refused, polling instead")
+
+        self._unsub_resubscribe = async_call_later(
+            self.hass, timeout.total_seconds() / 2, self._async_resubscribe
+        )
 
-        # do we need to (re-)subscribe?
-        now = dt_util.utcnow()
-        should_renew = (
-            self._subscription_renew_time and now >= self._subscription_renew_time
+    async def _async_resubscribe(self, now):
+        """Renew the event subscription, or retry a failed one."""
+        self._unsub_resubscribe = None
+        await self._async_subscribe()
+
+    def _has_event_subscriptions(self):
+        """Check every evented service of the device has a subscription."""
+        event_handler = self.hass.data[DLNA_DMR_DATA].event_handler
+        services = [
+            service
+            for service in self._device.device.services.values()
+            if service.service_type in EVENTED_SERVICE_TYPES
+        ]
+        return bool(services) and all(
+            event_handler.sid_for_service(service) is not None for service in services
         )
-        if should_renew or not was_available and self._available:
-            try:
-                timeout = await self._device.async_subscribe_services()
-                self._subscription_renew_time = dt_util.utcnow() + timeout / 2
-            except (asyncio.TimeoutError, aiohttp.ClientError):
-                self._available = False
-                _LOGGER.debug("Could not (re)subscribe")
 
+    @callback
+    def _async_clear_subscription(self):
+        """Forget the subscription of a device that went away."""
+        # Subscriptions are lost when a device goes away, so make sure the
+        # device is polled and subscribed again once it is back
+        self._async_cancel_resubscribe()
+        self._event_subscribed = False
+
+    @callback
+    def _async_cancel_resubscribe(self):
+        """Cancel a scheduled subscription renewal."""
+        if self._unsub_resubscribe is not None:
+            self._unsub_resubscribe()
+            self._unsub_resubscribe = None
+
+    @callback
     def _on_event(self, service, state_variables):
         """State variable(s) changed, let home-assistant know."""
-        self.schedule_update_ha_state()
+        if not state_variables:
+            # Polls report their results even when nothing changed
+            return
+
+        if self._state_write_handle is None:
+            self._state_write_handle = self.hass.loop.call_later(
+                EVENT_COALESCE_DELAY, self._async_write_coalesced_state
+            )
+
+    @callback
+    def _async_write_coalesced_state(self):
+        """Write the state once for all events received since the first."""
+        self._state_write_handle = None
+        self.async_write_ha_state()
 
     @property
     def supported_features(self):
         """Flag media player features that are supported."""
+        # services and actions of a device are fixed once it has been created
+        if self._supported_features is not None:
+            return self._supported_features
+
         supported_features = 0
 
         if self._device.has_volume_level:
@@ -277,6 +431,7 @@ class DlnaDmrDevice(MediaPlayerEntity):
         if self._device.has_seek_rel_time:
             supported_features |= SUPPORT_SEEK
 
+        self._supported_features = supported_features
         return supported_features
 
     @property
@@ -286,7 +441,7 @@ class DlnaDmrDevice(MediaPlayerEntity):
             return self._device.volume_level
         return 0
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_set_volume_level(self, volume):
         """Set volume level, range 0..1."""
         await self._device.async_set_volume_level(volume)
@@ -296,13 +451,13 @@ class DlnaDmrDevice(MediaPlayerEntity):
         """Boolean if volume is currently muted."""
         return self._device.is_volume_muted
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_mute_volume(self, mute):
         """Mute the volume."""
         desired_mute = bool(mute)
         await self._device.async_mute_volume(desired_mute)
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_media_pause(self):
         """Send pause command."""
         if not self._device.can_pause:
@@ -311,7 +466,7 @@ class DlnaDmrDevice(MediaPlayerEntity):
 
         await self._device.async_pause()
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_media_play(self):
         """Send play command."""
         if not self._device.can_play:
@@ -320,7 +475,7 @@ class DlnaDmrDevice(MediaPlayerEntity):
 
         await self._device.async_play()
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_media_stop(self):
         """Send stop command."""
         if not self._device.can_stop:
@@ -329,7 +484,7 @@ class DlnaDmrDevice(MediaPlayerEntity):
 
         await self._device.async_stop()
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_media_seek(self, position):
         """Send seek command."""
         if not self._device.can_seek_rel_time:
@@ -339,7 +494,7 @@ class DlnaDmrDevice(MediaPlayerEntity):
         time = timedelta(seconds=position)
         await self._device.async_seek_rel_time(time)
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_play_media(self, media_type, media_id, **kwargs):
         """Play a piece of media."""
         title = "Home Assistant"
@@ -365,7 +520,7 @@ class DlnaDmrDevice(MediaPlayerEntity):
         # Play it
         await self.async_media_play()
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_media_previous_track(self):
         """Send previous track command."""
         if not self._device.can_previous:
@@ -374,7 +529,7 @@ class DlnaDmrDevice(MediaPlayerEntity):
 
         await self._device.async_previous()
 
-    @catch_request_errors()
+    @catch_request_errors
     async def async_media_next_track(self):
         """Send next track command."""
         if not self._device.can_next:
@@ -436,4 +591,4 @@ class DlnaDmrDevice(MediaPlayerEntity):
     @property
     def unique_id(self) -> str:
         """Return an unique ID."""
-        return self._device.udn
+        return self._unique_id
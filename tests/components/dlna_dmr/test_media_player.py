@@ -0,0 +1,260 @@
+"""The tests for the DLNA DMR media player platform."""
+import asyncio
+from datetime import timedelta
+from unittest.mock import AsyncMock, Mock, patch
+
+from async_upnp_client.profiles.dlna import DeviceState
+import pytest
+
+from homeassistant.components import media_player
+from homeassistant.components.dlna_dmr import media_player as dlna_dmr
+from homeassistant.const import CONF_NAME, CONF_PLATFORM, CONF_URL, STATE_UNAVAILABLE
+from homeassistant.setup import async_setup_component
+import homeassistant.util.dt as dt_util
+
+from tests.common import async_fire_time_changed
+
+URL = "http://192.88.99.1/dmr_description.xml"
+NAME = "Test renderer"
+ENTITY_ID = "media_player.test_renderer"
+
+
+@pytest.fixture(name="dmr_device")
+def dmr_device_fixture():
+    """Patch the UPnP library to provide a mock DmrDevice."""
+    device = Mock()
+    device.udn = "uuid:7bf34520-f034-4fa2-8d2d-2f709d4221ef"
+    device.name = NAME
+    device.state = DeviceState.IDLE
+    for attr in (
+        "volume_level",
+        "is_volume_muted",
+        "media_title",
+        "media_image_url",
+        "media_duration",
+        "media_position",
+        "media_position_updated_at",
+    ):
+        setattr(device, attr, None)
+    device.async_update = AsyncMock()
+    device.async_subscribe_services = AsyncMock(return_value=timedelta(minutes=9))
+    device.async_unsubscribe_services = AsyncMock()
+    device.device.async_ping = AsyncMock()
+    device.device.services = {
+        service_type: Mock(service_type=service_type)
+        for service_type in (
+            "urn:schemas-upnp-org:service:AVTransport:1",
+            "urn:schemas-upnp-org:service:ConnectionManager:1",
+            "urn:schemas-upnp-org:service:RenderingControl:1",
+        )
+    }
+
+    with patch.object(dlna_dmr, "UpnpFactory") as factory, patch.object(
+        dlna_dmr, "AiohttpNotifyServer"
+    ) as notify_server, patch.object(
+        dlna_dmr, "DmrDevice", return_value=device
+    ), patch.object(
+        dlna_dmr, "get_local_ip", return_value="192.88.99.2"
+    ):
+        factory.return_value.async_create_device = AsyncMock()
+        notify_server.return_value.start_server = AsyncMock()
+        notify_server.return_value.stop_server = AsyncMock()
+        device.factory = factory.return_value
+        device.event_handler = notify_server.return_value.event_handler
+        device.event_handler.sid_for_service.return_value = "uuid:sid"
+        yield device
+
+
+async def setup_dlna_dmr(hass, renderers=1):
+    """Set up the platform with renderers sharing the same description URL."""
+    assert await async_setup_component(
+        hass,
+        media_player.DOMAIN,
+        {
+            media_player.DOMAIN: [
+                {CONF_PLATFORM: "dlna_dmr", CONF_URL: URL, CONF_NAME: NAME}
+            ]
+            * renderers
+        },
+    )
+    await hass.async_block_till_done()
+
+
+async def async_poll(hass):
+    """Advance the time by one scan interval of the platform poller."""
+    async_fire_time_changed(hass, dt_util.utcnow() + media_player.SCAN_INTERVAL)
+    await hass.async_block_till_done()
+
+
+async def async_renew(hass):
+    """Advance the time past the scheduled event subscription renewal."""
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(minutes=5))
+    await hass.async_block_till_done()
+
+
+async def test_events_coalesced(hass, dmr_device):
+    """Test a burst of events results in a single state write."""
+    await setup_dlna_dmr(hass)
+    service = Mock()
+
+    with patch.object(dlna_dmr, "EVENT_COALESCE_DELAY", 0), patch.object(
+        dlna_dmr.DlnaDmrDevice, "async_write_ha_state"
+    ) as write_state:
+        dmr_device.on_event(service, [Mock()])
+        dmr_device.on_event(service, [Mock(), Mock()])
+        await asyncio.sleep(0.01)
+        assert write_state.call_count == 1
+
+        dmr_device.on_event(service, [Mock()])
+        await asyncio.sleep(0.01)
+        assert write_state.call_count == 2
+
+
+async def test_removed_renderer_ignores_events(hass, dmr_device):
+    """Test a removed renderer unsubscribes and writes no state for events."""
+    await setup_dlna_dmr(hass)
+    event_handler = dmr_device.event_handler
+    event_handler.async_unsubscribe = AsyncMock()
+
+    with patch.object(dlna_dmr, "EVENT_COALESCE_DELAY", 0.01), patch.object(
+        dlna_dmr.DlnaDmrDevice, "async_write_ha_state"
+    ) as write_state:
+        dmr_device.on_event(Mock(), [Mock()])
+        await hass.data[media_player.DOMAIN].async_remove_entity(ENTITY_ID)
+        await asyncio.sleep(0.02)
+        assert write_state.call_count == 0
+
+    # DmrDevice only passes events on while on_event is set
+    assert dmr_device.on_event is None
+    # Only the services of this renderer, the event handler is shared
+    assert event_handler.async_unsubscribe.call_count == 3
+    event_handler.async_unsubscribe_all.assert_not_called()
+
+
+async def test_event_without_changes(hass, dmr_device):
+    """Test polls reporting no changed state variables write no state."""
+    await setup_dlna_dmr(hass)
+
+    with patch.object(dlna_dmr, "EVENT_COALESCE_DELAY", 0), patch.object(
+        dlna_dmr.DlnaDmrDevice, "async_write_ha_state"
+    ) as write_state:
+        dmr_device.on_event(Mock(), [])
+        await asyncio.sleep(0.01)
+        assert write_state.call_count == 0
+
+
+async def test_subscribed_renderer_not_polled(hass, dmr_device):
+    """Test a subscribed renderer is only polled for position while playing."""
+    await setup_dlna_dmr(hass)
+    assert dmr_device.async_update.call_count == 1
+    assert dmr_device.async_subscribe_services.call_count == 1
+
+    await async_poll(hass)
+    assert dmr_device.async_update.call_count == 1
+    assert dmr_device.device.async_ping.call_count == 1
+
+    dmr_device.state = DeviceState.PLAYING
+    await async_poll(hass)
+    assert dmr_device.async_update.call_count == 2
+
+    await async_renew(hass)
+    assert dmr_device.async_subscribe_services.call_count == 2
+
+
+async def test_refused_subscription_polled(hass, dmr_device):
+    """Test a renderer refusing subscriptions is polled instead."""
+    dmr_device.event_handler.sid_for_service.return_value = None
+    await setup_dlna_dmr(hass)
+    assert dmr_device.async_subscribe_services.call_count == 1
+
+    await async_poll(hass)
+    assert dmr_device.async_update.call_count == 2
+    assert hass.states.get(ENTITY_ID).state != STATE_UNAVAILABLE
+
+    # Refusals are retried at the renewal interval, not more often
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(minutes=2))
+    await hass.async_block_till_done()
+    assert dmr_device.async_subscribe_services.call_count == 1
+
+    await async_renew(hass)
+    assert dmr_device.async_subscribe_services.call_count == 2
+
+
+async def test_idle_renderer_gone_unavailable(hass, dmr_device):
+    """Test a subscribed renderer that goes away is unavailable on next poll."""
+    await setup_dlna_dmr(hass)
+
+    dmr_device.device.async_ping.side_effect = asyncio.TimeoutError
+    dmr_device.async_update.side_effect = asyncio.TimeoutError
+    await async_poll(hass)
+    assert hass.states.get(ENTITY_ID).state == STATE_UNAVAILABLE
+
+    dmr_device.async_update.side_effect = None
+    await async_poll(hass)
+    assert hass.states.get(ENTITY_ID).state != STATE_UNAVAILABLE
+    assert dmr_device.async_subscribe_services.call_count == 2
+
+
+async def test_failed_renewal_resumes_polling(hass, dmr_device):
+    """Test a renderer that went away is polled and becomes unavailable."""
+    await setup_dlna_dmr(hass)
+
+    dmr_device.async_subscribe_services.side_effect = asyncio.TimeoutError
+    dmr_device.async_update.side_effect = asyncio.TimeoutError
+    await async_renew(hass)
+    await async_poll(hass)
+    assert dmr_device.async_update.call_count > 1
+    assert hass.states.get(ENTITY_ID).state == STATE_UNAVAILABLE
+
+
+async def test_resubscribe_on_recovery(hass, dmr_device):
+    """Test a renderer is polled while away and subscribed when back."""
+    dmr_device.state = DeviceState.PLAYING
+    await setup_dlna_dmr(hass)
+    assert dmr_device.async_subscribe_services.call_count == 1
+
+    dmr_device.async_update.side_effect = asyncio.TimeoutError
+    await async_poll(hass)
+    assert hass.states.get(ENTITY_ID).state == STATE_UNAVAILABLE
+
+    # No renewal is left scheduled while the renderer is away
+    dmr_device.state = DeviceState.IDLE
+    await async_renew(hass)
+    assert dmr_device.async_subscribe_services.call_count == 1
+
+    dmr_device.async_update.side_effect = None
+    await async_poll(hass)
+    assert hass.states.get(ENTITY_ID).state != STATE_UNAVAILABLE
+    assert dmr_device.async_subscribe_services.call_count == 2
+
+    await async_poll(hass)
+    assert dmr_device.async_update.call_count == 4
+
+
+async def test_unreachable_renderer_not_subscribed(hass, dmr_device):
+    """Test no subscription is attempted while polls of a renderer fail."""
+    dmr_device.async_update.side_effect = asyncio.TimeoutError
+    await setup_dlna_dmr(hass)
+    assert hass.states.get(ENTITY_ID).state == STATE_UNAVAILABLE
+    assert dmr_device.async_subscribe_services.call_count == 1
+
+    await async_poll(hass)
+    await async_renew(hass)
+    assert dmr_device.async_update.call_count > 2
+    assert dmr_device.async_subscribe_services.call_count == 1
+
+    dmr_device.async_update.side_effect = None
+    await async_poll(hass)
+    assert hass.states.get(ENTITY_ID).state != STATE_UNAVAILABLE
+    assert dmr_device.async_subscribe_services.call_count == 2
+
+
+async def test_aborted_add_not_subscribed(hass, dmr_device):
+    """Test an entity rejected by the platform does not subscribe."""
+    await setup_dlna_dmr(hass, renderers=2)
+    assert len(hass.states.async_entity_ids(media_player.DOMAIN)) == 1
+    assert dmr_device.factory.async_create_device.call_count == 1
+    assert dmr_device.async_subscribe_services.call_count == 1
+
+    await async_renew(hass)
+    assert dmr_device.async_subscribe_services.call_count == 2